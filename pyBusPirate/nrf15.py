@@ -1,5 +1,6 @@
 from pyBusPirateLite.BitBang import *
 import time, sys
+import swdframe
 
 # BY TED HERMAN
 
@@ -72,6 +73,7 @@ regtable = [
   regdesc(CONFIG,0x504,UICR),
   regdesc(ERASEPAGE,0x508,UICR),
   ] 
+regindex = dict( (e.Id,e) for e in regtable )
 
 Current = True # another enumeration for readability
 banks_last = { Current: None }
@@ -241,50 +243,23 @@ def ARM_init():
   R = Read(IDCODE)
   assert R == 0xbb11477
 
-def revbits(x):
-  #print "revbits of", hex(ord(x))
-  x = ord(x)
-  r = x & 1 
-  for i in range(7):
-    r = r << 1
-    x = x >> 1 
-    r = r | (x & 1) 
-  #print "revbits result", hex(r) 
-  return chr(r)
-    
 def ARMSWD_command(Register=0,Value=0,DP=True,Read=True):
   # Value - reverse order (LSB first) and convert to byte string
-  byteString  = chr(Value & 0xff)
-  byteString += chr((Value >> 8) & 0xff)
-  byteString += chr((Value >> 16) & 0xff)
-  byteString += chr((Value >> 24) & 0xff)
-  basecmd = "\x81"
-  addrbits = {0:"\x00", 4:"\x10", 8:"\x08", 0xC:"\x18"}[Register]
-  dpap = "\x00"
-  if not DP: dpap = "\x40"
-  oper = "\x00"
-  if Read:   oper = "\x20"
-  parity = ord(addrbits) | ord(dpap) | ord(oper) 
-  parity = chr(parity >> 3)
-  if parity in ("\x00","\x0f","\x0a","\x09","\x0c","\x06","\x05","\x03"):
-     parity = "\x00"
-  else: parity = "\x04"
-  command = ord(basecmd) | ord(parity) | ord(dpap) | ord(addrbits) | ord(oper)
-  command = chr(command)
+  byteString = swdframe.word(Value)
+  command = swdframe.request(Register=Register,DP=DP,Read=Read)
   if Read:
-     BBwriteCmd(revbits(command))
+     BBwriteCmd(command)
      R = readWordParity()
      portwrite(chr(ord(CMD_CLOCK_TICKS)|0x01))
      BBgetacks(1) 
      return R
   else:
-     BBwriteCmd(revbits(command))
+     BBwriteCmd(command)
      portwrite(chr(ord(CMD_CLOCK_TICKS)|0x01))
      BBgetacks(1) 
      BBwriteBytes(byteString)
      portwrite(CMD_WRITE_BITS) 
-     if Parity(Value): portwrite("\x80")
-     else:             portwrite("\x00")
+     portwrite(chr(swdframe.PARITYBYTE[Parity(Value)]))
      BBgetacks(2)
 
 def ARMdpRead(Register=0):
@@ -316,13 +291,7 @@ def ARMapWrite(Register=0,Value=None):
   return R
 
 def Parity(word):
-  parity = word
-  parity = parity ^ (parity >> 16)
-  parity = parity ^ (parity >> 8)
-  parity = parity ^ (parity >> 4)
-  parity = parity ^ (parity >> 2)
-  parity = parity ^ (parity >> 1)
-  return parity & 0x01
+  return swdframe.parity(word)
 
 def readWordParity():
   for i in range(4): portwrite(CMD_READ_BYTE)
@@ -348,10 +317,7 @@ def AHB_AP_init():
   assert R == 0x03000052
 
 def Read(register):
-  for e in regtable:   
-    if e.Id == register:
-      break 
-  assert e.Id == register
+  e = regindex[register]
   if e.Area == DP:
     return ARMdpRead(Register=e.Addr)
   if e.Area == AP:
@@ -388,10 +354,7 @@ def Read(register):
   assert False
 
 def Write(register,value):
-  for e in regtable:   
-    if e.Id == register:
-      break 
-  assert e.Id == register
+  e = regindex[register]
   if e.Area == DP:
     return ARMdpWrite(Register=e.Addr,Value=value)
   if e.Area == AP:
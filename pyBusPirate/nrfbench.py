@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+import imp, os, sys, time, json, random, tempfile
+import swdframe
+
+# BY TED HERMAN
+
+'''
+  Throughput benchmark for nrftool: mass erase, program and read back
+  (verify) an image, on the nrfsim model or on a real probe and board,
+  and report as JSON:
+
+     python nrfbench.py sim
+     python nrfbench.py /dev/ttyUSB0 --size 0x8000 --output run.json
+
+  For each phase (attach, AHB_AP_init, masserase, erase, write, verify,
+  crc_verify) and each operation (masserase, program, download, and
+  crc_verify, the check by CRC on the target) the report has the
+  wall time, the bytes and serial writes sent to the probe, the bytes
+  read back and the number of SWD transactions; operations also get
+  bytes/s, transactions per word and serial writes per page.
+
+  Nothing in nrftool is changed for this: the phases are timed by
+  wrapping nrftool's functions, the port is wrapped to count traffic,
+  and transactions are counted from the acks swdframe.decode() returns.
+
+  With the in-process model the host is never slowed down by the link,
+  so link_s holds the time SimPort charged for the serial line and USB
+  latency, and the rates are computed over wall_s + link_s.
+  nrfcheck.py runs the benchmark on the model and checks these rates
+  against floors, for CI.
+'''
+
+class CountingPort(object):
+  "wraps a serial port, counting what goes over it"
+  def __init__(self,port):
+    self.port = port
+    self.counts = { 'serial_writes': 0, 'bytes_out': 0,
+                    'serial_reads': 0, 'bytes_in': 0 }
+
+  def write(self,data):
+    self.counts['serial_writes'] += 1
+    self.counts['bytes_out'] += len(data)
+    return self.port.write(data)
+
+  def read(self,n=1):
+    data = self.port.read(n)
+    self.counts['serial_reads'] += 1
+    self.counts['bytes_in'] += len(data)
+    return data
+
+  def __getattr__(self,name):
+    return getattr(self.port,name)
+
+class Meter(object):
+  "accumulates counters per phase for wrapped functions"
+  def __init__(self,port):
+    self.port = port
+    self.transactions = 0
+    self.phases = dict()
+    self.active = list()
+
+  def snapshot(self):
+    r = dict(self.port.counts)
+    r['transactions'] = self.transactions
+    stats = getattr(self.port.port,'stats',None)
+    r['link_s'] = stats['link_time'] if stats else 0.0
+    r['wall_s'] = time.time()
+    return r
+
+  def wrap(self,module,name,phase):
+    function = getattr(module,name)
+    def timed(*a,**k):
+      if phase in self.active: return function(*a,**k)
+      self.active.append(phase)
+      before = self.snapshot()
+      try:
+        return function(*a,**k)
+      finally:
+        self.active.remove(phase)
+        after = self.snapshot()
+        record = self.phases.setdefault(phase,{'calls': 0})
+        record['calls'] += 1
+        for key in before:
+          record[key] = record.get(key,0) + after[key] - before[key]
+    setattr(module,name,timed)
+
+  def countDecode(self):
+    decode = swdframe.decode
+    def counted(response,expect):
+      words, acks = decode(response,expect)
+      self.transactions += len(acks)//3
+      return words, acks
+    swdframe.decode = counted
+
+def rates(record,nbytes,pagesize):
+  seconds = record['wall_s'] + record['link_s']
+  words, pages = max(1,nbytes//4), max(1,nbytes//pagesize)
+  r = dict(record)
+  r['bytes'] = nbytes
+  r['bytes_per_s'] = nbytes/seconds if seconds and nbytes else 0.0
+  r['transactions_per_word'] = float(record['transactions'])/words
+  r['serial_writes_per_page'] = float(record['serial_writes'])/pages
+  return r
+
+def loadTool():
+  here = os.path.dirname(os.path.abspath(__file__))
+  sys.dont_write_bytecode = True
+  return imp.load_source('nrftool',os.path.join(here,'nrftool'))
+
+def bench(dev,image,address=0,loader=False):
+  T = loadTool()
+  progfile = tempfile.NamedTemporaryFile(suffix=".bin",delete=False)
+  progfile.write(image)
+  progfile.close()
+  downloadfile = progfile.name + ".out"
+  argv = sys.argv
+  try:
+    sys.argv = ["nrftool","program",dev,"--progfile",progfile.name,
+                "--address",hex(address)] + ["--loader"]*loader
+    T.setByArgs()
+  finally:
+    sys.argv = argv
+  T.B.port = CountingPort(T.B.port)
+  meter = Meter(T.B.port)
+  meter.countDecode()
+  for name, phase in (('setupPirate','attach'),('ARM_init','attach'),
+                      ('AHB_AP_init','ahb_ap_init'),
+                      ('function_masserase','masserase'),
+                      ('function_program','program'),
+                      ('function_download','download'),
+                      ('erasePage','erase'),('writePage','write'),
+                      ('writeRuns','write'),
+                      ('readFlash','verify'),
+                      ('verifyProgram','crc_verify')):
+    meter.wrap(T,name,phase)
+
+  T.setupPirate()
+  T.ARM_init()
+  T.AHB_AP_init()
+  T.function_masserase()
+  T.function_program()
+  T.args.downloadfile, T.args.downloadsize = downloadfile, len(image)
+  T.function_download()
+  T.verifyProgram(T.readProgram())
+  pagesize = T.pageSize()
+  with open(downloadfile,'rb') as F:
+    readback = F.read()
+  os.unlink(progfile.name)
+  os.unlink(downloadfile)
+
+  phases = meter.phases
+  report = {
+    'device': dev,
+    'address': address,
+    'image_bytes': len(image),
+    'loader': loader,
+    'verified': readback == image.rstrip("\xff"),
+    'phases': phases,
+    'operations': {
+      'masserase': rates(phases['masserase'],0,pagesize),
+      'program': rates(phases['program'],len(image),pagesize),
+      'download': rates(phases['download'],len(image),pagesize),
+      'crc_verify': rates(phases['crc_verify'],len(image),pagesize),
+      },
+    }
+  chip = getattr(T.B,'chip',None)
+  if chip:
+    report['target'] = dict(chip.stats)
+    report['target'].update(T.B.port.port.pirate.target.stats)
+  return report
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(description='nrftool throughput benchmark')
+  parser.add_argument('dev',metavar='device',
+            help='buspirate device, eg /dev/ttyUSB0, or sim for the nrfsim model')
+  parser.add_argument('--image',metavar='image',default=None,
+            help='binary to program (default: random bytes)')
+  parser.add_argument('--size',metavar='size',default="0x4000",
+            help='size of the random image')
+  parser.add_argument('--address',metavar='address',default="0",
+            help='flash address to program')
+  parser.add_argument('--seed',metavar='seed',type=int,default=51,
+            help='seed for the random image')
+  parser.add_argument('--loader',action="store_true",
+            help='program through the flash loader run from RAM')
+  parser.add_argument('--output',metavar='output',default=None,
+            help='file for the JSON report (default: stdout)')
+  args = parser.parse_args()
+  if args.image:
+    with open(args.image,'rb') as F: image = F.read()
+  else:
+    R = random.Random(args.seed)
+    image = "".join(chr(R.randrange(256)) for i in range(int(args.size,0)))
+  stdout = sys.stdout
+  sys.stdout = sys.stderr   # nrftool's progress messages
+  try:
+    report = bench(args.dev,image,int(args.address,0),args.loader)
+  finally:
+    sys.stdout = stdout
+  text = json.dumps(report,indent=2,sort_keys=True)
+  if args.output:
+    with open(args.output,'w') as F: F.write(text + "\n")
+  else:
+    sys.stdout.write(text + "\n")
+
+if __name__ == "__main__": main()
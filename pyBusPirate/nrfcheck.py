@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import sys, random, json
+import nrfbench
+
+# BY TED HERMAN
+
+'''
+  Self-check of nrftool on the nrfsim model, for CI: program, verify
+  and download an image over SimPort, directly and through the flash
+  loader, with nrfbench, and fail (exit status 1) if the image does not
+  come back or a link rate falls below its floor:
+
+     python nrfcheck.py
+     python nrfcheck.py --size 0x8000 --report check.json
+
+  The rates are over wall_s + link_s, and link_s, the time SimPort
+  charges for the serial line and USB, is most of it; so the floors
+  hold on a slow host too, and are well above what per-word acks give.
+'''
+
+# bytes/s each operation must reach on the model
+FLOORS = { 'program': 1500.0, 'download': 2500.0, 'crc_verify': 5000.0 }
+# the most SWD transactions per word: one, and a little for setup
+MAX_TRANSACTIONS = { 'program': 1.5, 'download': 1.5 }
+
+def check(report,floors=FLOORS):
+  "the failures in an nrfbench report, as a list of messages"
+  failures = list()
+  if not report['verified']:
+    failures.append("download does not match the image")
+  for operation, floor in sorted(floors.items()):
+    rate = report['operations'][operation]['bytes_per_s']
+    if rate < floor:
+      failures.append("{0}: {1:.0f} bytes/s, below {2:.0f}".format(operation,rate,floor))
+  for operation, most in sorted(MAX_TRANSACTIONS.items()):
+    per_word = report['operations'][operation]['transactions_per_word']
+    if per_word > most:
+      failures.append("{0}: {1:.2f} transactions a word, above {2}".format(operation,per_word,most))
+  return failures
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(description='nrftool self-check on the nrfsim model')
+  parser.add_argument('--size',metavar='size',default="0x4000",
+            help='size of the random image')
+  parser.add_argument('--seed',metavar='seed',type=int,default=51,
+            help='seed for the random image')
+  parser.add_argument('--scale',metavar='scale',type=float,default=1.0,
+            help='multiply the rate floors by this')
+  parser.add_argument('--report',metavar='report',default=None,
+            help='file for the JSON reports of the runs')
+  args = parser.parse_args()
+  R = random.Random(args.seed)
+  image = "".join(chr(R.randrange(256)) for i in range(int(args.size,0)))
+  floors = dict( (k,v*args.scale) for k,v in FLOORS.items() )
+  reports, failed = dict(), False
+  for name, loader in (('direct',False),('loader',True)):
+    stdout = sys.stdout
+    sys.stdout = sys.stderr   # nrftool's progress messages
+    try:
+      reports[name] = report = nrfbench.bench("sim",image,0,loader)
+    finally:
+      sys.stdout = stdout
+    failures = check(report,floors)
+    rates = ", ".join("{0} {1:.0f}".format(operation,report['operations'][operation]['bytes_per_s'])
+                      for operation in sorted(floors))
+    sys.stdout.write("{0}: {1} (bytes/s) {2}\n".format(name,rates,"FAIL" if failures else "ok"))
+    for message in failures:
+      sys.stdout.write("  {0}\n".format(message))
+    failed = failed or bool(failures)
+  if args.report:
+    with open(args.report,'w') as F:
+      F.write(json.dumps(reports,indent=2,sort_keys=True) + "\n")
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__": main()
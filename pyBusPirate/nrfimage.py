@@ -0,0 +1,197 @@
+import struct
+
+# BY TED HERMAN
+
+'''
+  Program images for nrftool: raw binaries, Intel HEX and ELF files,
+  read into a sparse map of segments, and cut into the flash pages
+  that have data in them.
+
+  A SoftDevice plus application layout is a typical case: the segments
+  are far apart, and only the pages they touch get erased and written,
+  in address order, so each page is one TAR load and one stream of
+  writes. Within a page, gaps between segments are filled with 0xff,
+  which is what the erase leaves there anyway. Data for UICR (a
+  bootloader address, say) is not paged: words() splits it off, to be
+  written a word at a time.
+'''
+
+ELF_HEADER = 52   # bytes in the header of a 32 bit ELF file
+
+class ImageError(Exception): pass
+
+def load(filename,address=0):
+  '''
+  Read an image file as a sorted list of (address,data) segments; the
+  format is taken from the contents (ELF) or the name (.hex, .ihex),
+  and anything else is a raw binary placed at address
+  '''
+  with open(filename,'rb') as F:
+    content = F.read()
+  if content[:4] == "\x7fELF":
+    return merge(elfSegments(content))
+  if filename.lower().endswith((".hex",".ihex")):
+    return merge(hexSegments(content))
+  return [(address,content)] if content else []
+
+def hexSegments(content):
+  "the data records of an Intel HEX file, as (address,data) segments"
+  segments, base = list(), 0
+  for number, line in enumerate(content.splitlines(),1):
+    line = line.strip()
+    if not line: continue
+    try:
+      assert line.startswith(":")
+      record = bytearray(line[1:].decode("hex"))
+    except (AssertionError,TypeError):
+      raise ImageError("line {0}: not an Intel HEX record".format(number))
+    if len(record) < 5 or len(record) != 5 + record[0]:
+      raise ImageError("line {0}: bad record length".format(number))
+    if sum(record) & 0xff:
+      raise ImageError("line {0}: bad checksum".format(number))
+    count, offset, kind = record[0], (record[1] << 8) | record[2], record[3]
+    data = bytes(record[4:4+count])
+    if kind == 0x00: segments.append((base + offset,data))
+    elif kind == 0x01: break
+    elif kind in (0x02,0x04) and count != 2:
+      raise ImageError("line {0}: bad address record".format(number))
+    elif kind == 0x02: base = struct.unpack(">H",data)[0] << 4
+    elif kind == 0x04: base = struct.unpack(">H",data)[0] << 16
+    elif kind not in (0x03,0x05):   # start addresses
+      raise ImageError("line {0}: unknown record type {1:02x}".format(number,kind))
+  return segments
+
+def elfSegments(content):
+  '''
+  The loadable segments of a 32 bit little-endian ELF file, at their
+  physical (load) addresses, so initialised data goes where the startup
+  code copies it from
+  '''
+  if content[4:6] != "\x01\x01":
+    raise ImageError("only 32 bit little-endian ELF files are supported")
+  if len(content) < ELF_HEADER: raise ImageError("truncated ELF header")
+  phoff, = struct.unpack_from("<I",content,28)
+  phentsize, phnum = struct.unpack_from("<HH",content,42)
+  if phnum and phoff >= len(content):
+    raise ImageError("ELF program headers past the end of the file")
+  segments = list()
+  for i in range(phnum):
+    try:
+      p_type, p_offset, p_vaddr, p_paddr, p_filesz = \
+        struct.unpack_from("<5I",content,phoff + i*phentsize)
+    except struct.error:
+      raise ImageError("truncated ELF program header")
+    if p_type != 1 or not p_filesz: continue   # PT_LOAD, with contents
+    data = content[p_offset:p_offset+p_filesz]
+    if len(data) != p_filesz: raise ImageError("truncated ELF segment")
+    segments.append((p_paddr,data))
+  return segments
+
+def symbols(filename):
+  '''
+  The symbol table of a 32 bit little-endian ELF file, as a dict of
+  name to (value,size), e.g. to find variables by name
+  '''
+  with open(filename,'rb') as F:
+    content = F.read()
+  if content[:4] != "\x7fELF" or content[4:6] != "\x01\x01":
+    raise ImageError("{0}: not a 32 bit little-endian ELF file".format(filename))
+  if len(content) < ELF_HEADER: raise ImageError("truncated ELF header")
+  shoff, = struct.unpack_from("<I",content,32)
+  shentsize, shnum = struct.unpack_from("<HH",content,46)
+  if shnum and shoff >= len(content):
+    raise ImageError("ELF section headers past the end of the file")
+  try:
+    sections = [ struct.unpack_from("<10I",content,shoff + i*shentsize)
+                 for i in range(shnum) ]
+  except struct.error:
+    raise ImageError("truncated ELF section header")
+  result = dict()
+  for sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, \
+      sh_link, sh_info, sh_addralign, sh_entsize in sections:
+    if sh_type != 2: continue   # SHT_SYMTAB
+    if sh_link >= len(sections) or sh_offset + sh_size > len(content):
+      raise ImageError("truncated ELF symbol table")
+    strtab = sections[sh_link]
+    names = content[strtab[4]:strtab[4]+strtab[5]]
+    for k in range(sh_offset,sh_offset+sh_size-15,16):
+      st_name, st_value, st_size = struct.unpack_from("<3I",content,k)
+      end = names.find("\0",st_name)
+      name = names[st_name:end if end >= 0 else len(names)]
+      if name: result[name] = (st_value,st_size)
+  return result
+
+def merge(segments):
+  "sort segments and join those that touch; overlapping ones are an error"
+  result = list()
+  for address, data in sorted(segments):
+    if result and address < result[-1][0] + len(result[-1][1]):
+      raise ImageError("segments overlap at {0:08x}".format(address))
+    if result and address == result[-1][0] + len(result[-1][1]):
+      result[-1] = (result[-1][0],result[-1][1] + data)
+    else:
+      result.append((address,data))
+  return result
+
+def inside(segments,size):
+  "check that the segments lie in flash of size bytes, from address 0"
+  for address, data in segments:
+    if address < 0 or address + len(data) > size:
+      raise ImageError("{0} bytes at {1:08x} are outside code flash (00000000 to {2:08x})".format(
+                       len(data),address,size))
+
+def words(segments,start,size):
+  '''
+  Split off the data in start..start+size (UICR, say) as a dict of
+  word address to word, bytes missing from a word being 0xff, which
+  writes leave as they are; returns (other segments, words)
+  '''
+  rest, found = list(), dict()
+  for address, data in segments:
+    if start <= address and address + len(data) <= start + size:
+      for offset, byte in enumerate(bytearray(data)):
+        word, shift = (address + offset) & ~3, 8*((address + offset) % 4)
+        found[word] = found.get(word,0xffffffff) & ~(0xff << shift) | byte << shift
+    else:
+      rest.append((address,data))
+  return rest, found
+
+def pages(segments,pagesize=1024,size=None):
+  '''
+  The pages with data in them, as sorted (page address, contents) pairs,
+  the contents running from the start of the page to the last byte of
+  data in it, with gaps filled with 0xff; segments outside the first
+  size bytes, when given, are an error
+  '''
+  if size is not None: inside(segments,size)
+  contents = dict()
+  for address, data in segments:
+    while data:
+      page = address - address % pagesize
+      n = min(len(data),page + pagesize - address)
+      chunk = bytearray(contents.get(page,""))
+      end = address - page + n
+      if len(chunk) < end: chunk.extend("\xff"*(end - len(chunk)))
+      chunk[address-page:end] = data[:n]
+      contents[page] = bytes(chunk)
+      address, data = address + n, data[n:]
+  return sorted(contents.items())
+
+def overlay(segments,read,pagesize=1024,size=None):
+  '''
+  Merge segments into the pages they touch, as sorted (page,old,new)
+  triples of whole pages, where read(page) gives the current contents
+  of a page: for patching bytes at any address inside live pages
+  '''
+  if size is not None: inside(segments,size)
+  old, new = dict(), dict()
+  for address, data in segments:
+    while data:
+      page = address - address % pagesize
+      if page not in old:
+        old[page] = bytes(read(page))
+        new[page] = bytearray(old[page])
+      n = min(len(data),page + pagesize - address)
+      new[page][address-page:address-page+n] = data[:n]
+      address, data = address + n, data[n:]
+  return [ (page,old[page],bytes(new[page])) for page in sorted(old) ]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+import imp, os, sys, time, glob, json, multiprocessing, traceback
+
+# BY TED HERMAN
+
+'''
+  Run one nrftool function on many probes at once, e.g. to flash a
+  fixture of boards, each with its own Bus Pirate:
+
+     python nrfmulti.py program --progfile app.hex --verify
+     python nrfmulti.py download --downloadfile flash.bin --downloadsize 0x40000
+     python nrfmulti.py program --probes sim:a.img,sim:b.img --progfile app.hex
+
+  The probes are /dev/ttyUSB* unless --probes lists them; any option
+  nrfmulti does not know is passed on to nrftool.  Each probe gets an
+  SwdSession in a process of its own (at most --jobs at a time), and
+  its output goes to a log in --logdir, named after the device; for
+  download, the device name is also added to --downloadfile.
+
+  At the end there is a line per probe and a summary, and the exit
+  status is 1 if any probe failed.
+'''
+
+def loadTool():
+  here = os.path.dirname(os.path.abspath(__file__))
+  sys.dont_write_bytecode = True
+  return imp.load_source('nrftool',os.path.join(here,'nrftool'))
+
+def discover():
+  "the Bus Pirates plugged in, as serial devices"
+  return sorted(glob.glob("/dev/ttyUSB*"))
+
+def probeNames(probes):
+  "a name for each probe, for logs and files, unique even for sim probes"
+  names, seen = list(), dict()
+  for dev in probes:
+    name = os.path.basename(dev.replace(":","-")) or "probe"
+    seen[name] = seen.get(name,0) + 1
+    if seen[name] > 1: name = "{0}.{1}".format(name,seen[name])
+    names.append(name)
+  return names
+
+def probeArgv(function,dev,name,options):
+  "the nrftool command line for one probe"
+  options = list(options)
+  if function == "download" and "--downloadfile" in options:
+    k = options.index("--downloadfile") + 1
+    root, ext = os.path.splitext(options[k])
+    options[k] = "{0}-{1}{2}".format(root,name,ext)
+  return [function,dev] + options
+
+def runProbe(job):
+  "in a worker process: run nrftool for one probe, output to its log"
+  dev, name, argv, logfile = job
+  result = { 'probe': dev, 'name': name, 'log': logfile, 'ok': False }
+  start = time.time()
+  stdout, stderr = sys.stdout, sys.stderr
+  with open(logfile,'w') as log:
+    sys.stdout = sys.stderr = log
+    try:
+      session = loadTool().SwdSession(argv)
+      session.run()
+      result['ok'] = True
+      # nrfsim probes save their flash file at exit, which workers skip
+      getattr(session.B,'save',lambda: None)()
+    except SystemExit as e:
+      result['error'] = "exit status {0}".format(e.code)
+    except Exception as e:
+      traceback.print_exc()
+      result['error'] = repr(e)
+    finally:
+      sys.stdout, sys.stderr = stdout, stderr
+  result['seconds'] = time.time() - start
+  return result
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(description='nrftool on many probes',
+            epilog='other options are passed on to nrftool')
+  parser.add_argument("function",help='nrftool function, eg program or download')
+  parser.add_argument('--probes',metavar='probes',default=None,
+            help='comma separated devices (default: /dev/ttyUSB*)')
+  parser.add_argument('--jobs',metavar='jobs',type=int,default=0,
+            help='probes run at once (default: all of them)')
+  parser.add_argument('--logdir',metavar='logdir',default="nrfmulti-logs",
+            help='directory for the per-probe logs')
+  parser.add_argument('--output',metavar='output',default=None,
+            help='file for a JSON summary')
+  args, options = parser.parse_known_args()
+  probes = args.probes.split(",") if args.probes else discover()
+  if not probes:
+    sys.stderr.write("No probes found (try --probes)\n")
+    sys.exit(1)
+  if not os.path.isdir(args.logdir): os.makedirs(args.logdir)
+  names = probeNames(probes)
+  jobs = [ (dev,name,probeArgv(args.function,dev,name,options),
+            os.path.join(args.logdir,name + ".log"))
+           for dev, name in zip(probes,names) ]
+
+  sys.stdout.write("Running {0} on {1} probes\n".format(args.function,len(jobs)))
+  start = time.time()
+  pool = multiprocessing.Pool(args.jobs or len(jobs))
+  results = list()
+  for result in pool.imap_unordered(runProbe,jobs):
+    sys.stdout.write("{0:<16} {1:<4} {2:7.1f}s  {3}\n".format(result['name'],
+        "ok" if result['ok'] else "FAIL",result['seconds'],
+        result.get('error',result['log'])))
+    sys.stdout.flush()
+    results.append(result)
+  pool.close()
+  pool.join()
+  elapsed = time.time() - start
+  failed = [ r['name'] for r in results if not r['ok'] ]
+  sys.stdout.write("{0} of {1} probes ok in {2:.1f}s (sum of probe times {3:.1f}s)\n".format(
+      len(results)-len(failed),len(results),elapsed,
+      sum(r['seconds'] for r in results)))
+  if failed: sys.stdout.write("Failed: {0}\n".format(" ".join(sorted(failed))))
+  if args.output:
+    with open(args.output,'w') as F:
+      json.dump({ 'function': args.function, 'seconds': elapsed,
+                  'probes': sorted(results,key=lambda r: r['name']) },
+                F,indent=2,sort_keys=True)
+      F.write("\n")
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__": main()
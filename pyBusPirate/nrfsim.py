@@ -0,0 +1,965 @@
+#!/usr/bin/env python
+from pyBusPirateLite.BitBang import BBIO
+import os, sys, time
+
+# BY TED HERMAN
+
+'''
+  Software model of a Bus Pirate in raw-wire binary mode with an nRF51
+  attached by SWD.  The model works at the byte level of the Bus Pirate
+  protocol (see http://dangerousprototypes.com/docs/Raw-wire_(binary))
+  and at the bit level of SWD, so nrftool can be run, measured and
+  regression tested without a probe or a board:
+
+     nrftool info sim                       (in-process model)
+     nrftool info sim:flash.img             (in-process, with the flash
+                                             kept in flash.img)
+     python nrfsim.py                       (model served on a pty, the
+     nrftool info /dev/pts/N                 slave name is printed)
+
+  What is modelled:
+
+     Bus Pirate   -- terminal, BBIO and raw-wire modes, the raw-wire
+                     configuration, speed and peripheral commands, bulk
+                     bytes/bits/clock ticks, read byte and read bit
+
+     SW-DP        -- line reset, JTAG-to-SWD switch, IDCODE, ABORT,
+                     CTRL/STAT (power-up handshake, ORUNDETECT and the
+                     sticky flags), SELECT, RDBUF and WAIT/FAULT acks
+
+     AHB-AP       -- CSW (size, auto-increment), TAR with the 1 KB
+                     auto-increment wrap, DRW, BD0-BD3, IDR, CFG, BASE,
+                     and posted reads (an AP read returns the result of
+                     the previous AP read)
+
+     nRF51        -- flash array, FICR, UICR, RAM and the NVMC registers
+                     READY, CONFIG, ERASEPAGE, ERASEALL and ERASEUICR, with
+                     erase and write times taken from the product
+                     specification; DHCSR, DCRSR, DCRDR and CPUID in the SCS
+
+     Cortex-M0    -- enough of the core to run code loaded into RAM by
+                     the debugger (flash loaders): ARMv6-M Thumb, halt,
+                     resume and BKPT, core registers through DCRSR
+
+  The time base is time.time(), so NVMC operations take as long as they
+  would on a real device and polling behaviour can be measured.  In
+  process, SimPort also charges the model's clock with the time each
+  byte would take on the serial line and with the USB latency of every
+  turnaround, so the link is as slow, as seen by the target, as a real
+  one (the host is not slowed down; the charged time is reported in
+  SimPort.stats['link_time']).
+'''
+
+# nRF51 product specification, maximum NVMC timings in seconds (nrftool
+# schedules its waits from these too)
+NVMC_TIMING = { 'write': 46.3e-6, 'erasepage': 22.3e-3, 'eraseall': 22.3e-3 }
+# and the same for the nRF52832, which has 4 KB pages
+NVMC_TIMING_NRF52 = { 'write': 67.5e-6, 'erasepage': 85e-3, 'eraseall': 173e-3 }
+
+CPU_HZ = 16e6   # nRF51 core clock
+
+IDCODE_SWDP = 0x0bb11477
+AHB_AP_IDR = 0x04770021
+CPUID_M0 = 0x410cc200
+
+# SWD acknowledgements, in wire order (LSB first)
+ACK_OK, ACK_WAIT, ACK_FAULT = 0x1, 0x2, 0x4
+
+# CTRL/STAT bits
+ORUNDETECT = 0x00000001
+STICKYORUN = 0x00000002
+STICKYCMP  = 0x00000010
+STICKYERR  = 0x00000020
+WDATAERR   = 0x00000080
+PWRUPREQ   = 0x50000000
+PWRUPACK   = 0xa0000000
+
+class BusFault(Exception): pass
+
+class LinkClock(object):
+  "time.time() plus the time the modelled serial link has spent"
+  def __init__(self):
+    self.offset = 0.0
+
+  def __call__(self):
+    return time.time() + self.offset
+
+  def advance(self,seconds):
+    self.offset += seconds
+
+def parity32(word):
+  word ^= word >> 16
+  word ^= word >> 8
+  word ^= word >> 4
+  word ^= word >> 2
+  word ^= word >> 1
+  return word & 1
+
+class NRF51(object):
+  '''
+  Memory map and peripherals of the target.  Geometry defaults are those
+  of an nRF51822 QFAA (256 pages of 1 KB, 16 KB RAM); pass codepagesize
+  and codesize for other parts. With pages other than 1 KB the FICR is
+  that of an nRF52, which gives the RAM size in INFO.RAM.
+  '''
+  FLASH_BASE = 0x00000000
+  FICR_BASE  = 0x10000000
+  UICR_BASE  = 0x10001000
+  RAM_BASE   = 0x20000000
+  NVMC_BASE  = 0x4001e000
+
+  def __init__(self,codepagesize=1024,codesize=256,ramsize=0x4000,
+               deviceid=0x1234567889abcdef,timing=None,clock=None):
+    self.codepagesize, self.codesize = codepagesize, codesize
+    self.flash = bytearray(b"\xff"*(codepagesize*codesize))
+    self.uicr = bytearray(b"\xff"*(0x100 if codepagesize == 1024 else 0x400))
+    self.ram = bytearray(ramsize)
+    self.ficr = { 0x010: codepagesize, 0x014: codesize, 0x028: 0xffffffff,
+                  0x02c: 0xffffff00, 0x034: 2, 0x038: ramsize//2,
+                  0x03c: ramsize//2, 0x05c: 0xffff0072,
+                  0x060: deviceid & 0xffffffff, 0x064: deviceid >> 32,
+                  0x0a0: 0xffffffff, 0x0a4: 0x89abcdef, 0x0a8: 0x0123 }
+    if codepagesize != 1024:   # the FICR of an nRF52: INFO.PART, INFO.RAM
+      for offset in (0x028,0x02c,0x034,0x038,0x03c): del self.ficr[offset]
+      self.ficr.update({ 0x100: 0x52832, 0x10c: ramsize//1024 })
+    self.timing = dict(NVMC_TIMING if codepagesize == 1024 else NVMC_TIMING_NRF52)
+    if timing: self.timing.update(timing)
+    self.clock = clock or LinkClock()
+    self.nvmc_config = 0
+    self.nvmc_busy_until = 0.0
+    self.when = None
+    self.cpu = CortexM0(self)
+    self.stats = { 'erasepage': 0, 'eraseall': 0, 'write': 0,
+                   'instructions': 0, 'core_time': 0.0 }
+
+  def load(self,filename):
+    "set the flash contents from a binary file"
+    with open(filename,'rb') as F:
+      data = bytearray(F.read())[:len(self.flash)]
+    self.flash[:len(data)] = data
+
+  def now(self):
+    "the time of the access in progress: the host's, or the core's"
+    return self.clock() if self.when is None else self.when
+
+  def busy(self):
+    return self.now() < self.nvmc_busy_until
+
+  def _nvmc_start(self,operation):
+    self.stats[operation] += 1
+    self.nvmc_busy_until = max(self.now(),self.nvmc_busy_until) + \
+                           self.timing[operation]
+
+  def accessDelay(self,address):
+    "seconds until an AHB access to address can complete"
+    if address < self.FICR_BASE or self.UICR_BASE <= address < self.RAM_BASE:
+      return max(0.0,self.nvmc_busy_until-self.clock())
+    return 0.0
+
+  def read32(self,address):
+    a = address & 0xfffffffc
+    if a < len(self.flash):
+      return self._word(self.flash,a)
+    if self.FICR_BASE <= a < self.FICR_BASE+0x1000:
+      return self.ficr.get(a-self.FICR_BASE,0xffffffff)
+    if self.UICR_BASE <= a < self.UICR_BASE+len(self.uicr):
+      return self._word(self.uicr,a-self.UICR_BASE)
+    if self.RAM_BASE <= a < self.RAM_BASE+len(self.ram):
+      return self._word(self.ram,a-self.RAM_BASE)
+    if self.NVMC_BASE <= a < self.NVMC_BASE+0x1000:
+      r = a - self.NVMC_BASE
+      if r == 0x400: return 0 if self.busy() else 1
+      if r == 0x504: return self.nvmc_config
+      return 0
+    if a == 0xe000ed00: return CPUID_M0
+    if a == 0xe000edf0: return self.cpu.readDhcsr()
+    if a == 0xe000edf8: return self.cpu.dcrdr
+    if a == 0xe000edfc: return self.cpu.demcr
+    if 0x40000000 <= a < 0x50001000 or 0xe0000000 <= a or \
+       0xf0000000 <= a: return 0
+    raise BusFault(address)
+
+  def write32(self,address,value):
+    a, value = address & 0xfffffffc, value & 0xffffffff
+    if a < len(self.flash):
+      return self._program(self.flash,a,value)
+    if self.UICR_BASE <= a < self.UICR_BASE+len(self.uicr):
+      return self._program(self.uicr,a-self.UICR_BASE,value)
+    if self.RAM_BASE <= a < self.RAM_BASE+len(self.ram):
+      return self._store(self.ram,a-self.RAM_BASE,value)
+    if self.NVMC_BASE <= a < self.NVMC_BASE+0x1000:
+      return self._nvmc(a-self.NVMC_BASE,value)
+    if a == 0xe000ed0c: return self.cpu.writeAircr(value)
+    if a == 0xe000edf0: return self.cpu.writeDhcsr(value)
+    if a == 0xe000edf4: return self.cpu.writeDcrsr(value)
+    if a == 0xe000edf8: self.cpu.dcrdr = value; return
+    if a == 0xe000edfc: self.cpu.demcr = value; return
+    if 0x40000000 <= a < 0x50001000 or 0xe0000000 <= a: return
+    if self.FICR_BASE <= a < self.FICR_BASE+0x1000: return
+    raise BusFault(address)
+
+  def read16(self,address):
+    return (self.read32(address) >> (8*(address & 2))) & 0xffff
+
+  def _word(self,memory,offset):
+    b = memory[offset:offset+4]
+    return b[0] | (b[1] << 8) | (b[2] << 16) | (b[3] << 24)
+
+  def _store(self,memory,offset,value):
+    for i in range(4): memory[offset+i] = (value >> (8*i)) & 0xff
+
+  def _program(self,memory,offset,value):
+    if self.nvmc_config & 3 != 1: return   # CONFIG.WEN not set: ignored
+    self._nvmc_start('write')
+    self._store(memory,offset,self._word(memory,offset) & value)
+
+  def _nvmc(self,register,value):
+    if register == 0x504: self.nvmc_config = value & 3; return
+    if self.nvmc_config & 3 != 2: return   # CONFIG.EEN not set: ignored
+    if register in (0x508,0x510):          # ERASEPAGE / ERASEPCR0
+      page = value - (value % self.codepagesize)
+      if 0 <= page < len(self.flash):
+        self.flash[page:page+self.codepagesize] = \
+          b"\xff"*self.codepagesize
+        self._nvmc_start('erasepage')
+    elif register == 0x50c and value & 1:   # ERASEALL
+      self.flash[:] = b"\xff"*len(self.flash)
+      self.uicr[:] = b"\xff"*len(self.uicr)
+      self._nvmc_start('eraseall')
+    elif register == 0x514 and value & 1:   # ERASEUICR
+      self.uicr[:] = b"\xff"*len(self.uicr)
+      self._nvmc_start('erasepage')
+
+class CortexM0(object):
+  '''
+  Just enough of the Cortex-M0 to run code the debugger puts in RAM,
+  such as a flash loader: the ARMv6-M Thumb instructions except those
+  for exceptions and system state, and the debug registers DHCSR,
+  DCRSR, DCRDR and DEMCR.  Faults and undefined instructions lock the
+  core up (S_LOCKUP) instead of taking an exception.
+
+  The model has no firmware to run out of reset, so the core only runs
+  once the debugger has halted it, set its PC through DCRSR and let it
+  go; otherwise it stays idle.  BKPT halts it, as on the real part with
+  C_DEBUGEN set.  Instructions take no time, but the core stalls while
+  the NVMC is busy, as the nRF51 CPU does.  It is run by run(), lazily,
+  when the debugger accesses memory, and keeps its own time so that the
+  NVMC operations it starts are timed from when it would have started
+  them. Interpreting an instruction takes the host far longer than a
+  cycle of the real core, so slowdown() tells the debugger how much to
+  stretch the time it allows code to run.
+  '''
+  MAXSTEPS = 1 << 16    # instructions per run(), for runaway code
+
+  def __init__(self,chip):
+    self.chip = chip
+    self.core = [0]*21   # r0-r12, sp, lr, pc, xpsr, msp, psp, primask, control
+    self.dhcsr = 0
+    self.dcrdr = 0
+    self.demcr = 0
+    self.halted = self.running = self.lockup = False
+    self.pcset = False
+    self.time = 0.0      # how far the core has run, on the chip's clock
+
+  # -- debug registers --------------------------------------------------
+
+  def readDhcsr(self):
+    r = self.dhcsr & 0x0000002f
+    r |= 0x00010000                         # S_REGRDY
+    if self.halted: r |= 0x00020000         # S_HALT
+    if self.lockup: r |= 0x00080000         # S_LOCKUP
+    return r
+
+  def writeDhcsr(self,value):
+    if value >> 16 != 0xa05f: return
+    if not self.halted:   # C_MASKINTS only changes while halted
+      value = (value & ~0x8) | (self.dhcsr & 0x8)
+    self.dhcsr = value & 0x2f
+    if not self.dhcsr & 1: self.dhcsr = 0   # C_HALT needs C_DEBUGEN
+    if self.dhcsr & 2:
+      self.halted, self.running, self.pcset = True, False, False
+    elif self.halted:
+      self.halted, self.running = False, self.pcset
+      self.lockup = False
+      self.time = self.chip.clock()
+
+  def writeDcrsr(self,value):
+    n = value & 0x1f
+    if n >= len(self.core): return
+    if value & 0x10000:
+      self.core[n] = self.dcrdr
+      if n == 15: self.core[n] &= ~1; self.pcset = True
+      if n == 13: self.core[17] = self.core[13]
+    else:
+      self.dcrdr = self.core[n]
+
+  def writeAircr(self,value):
+    if value >> 16 != 0x05fa or not value & 4: return
+    # SYSRESETREQ: back to the firmware, which the model does not run
+    self.running = self.lockup = False
+    self.halted = bool(self.demcr & 1)      # VC_CORERESET
+    if self.halted: self.dhcsr |= 2
+
+  # -- execution --------------------------------------------------------
+
+  def run(self):
+    "catch up with the host: execute until halted or stalled past now"
+    now, steps, start = self.chip.clock(), 0, time.time()
+    try:
+      while self.running and steps < self.MAXSTEPS:
+        steps += 1
+        # the core stalls while the NVMC is busy
+        self.time = max(self.time,self.chip.nvmc_busy_until)
+        if self.time > now: return
+        self.chip.when = self.time
+        try:
+          self.step()
+        except (BusFault, ValueError):
+          self.running, self.lockup = False, True
+        self.chip.stats['instructions'] += 1
+    finally:
+      self.chip.when = None
+      if steps: self.chip.stats['core_time'] += time.time() - start
+
+  def slowdown(self):
+    "how many times slower than the real core the model has run code"
+    stats = self.chip.stats
+    if not stats['instructions']: return 1.0
+    return max(1.0,stats['core_time']*CPU_HZ/stats['instructions'])
+
+  def _flags(self,result,carry=None,overflow=None):
+    "set N and Z from result, and C and V when given; returns result"
+    result &= 0xffffffff
+    psr = self.core[16] & 0x0fffffff
+    psr |= result & 0x80000000
+    if not result: psr |= 0x40000000
+    c = (self.core[16] >> 29) & 1 if carry is None else carry
+    v = (self.core[16] >> 28) & 1 if overflow is None else overflow
+    self.core[16] = psr | (c << 29) | (v << 28)
+    return result
+
+  def _add(self,a,b,carry=0):
+    result = a + b + carry
+    overflow = ((a ^ result) & (b ^ result)) >> 31 & 1
+    return self._flags(result,int(result > 0xffffffff),overflow)
+
+  def _sub(self,a,b,carry=1):
+    return self._add(a,~b & 0xffffffff,carry)
+
+  def _condition(self,cond):
+    psr = self.core[16]
+    n, z = psr >> 31 & 1, psr >> 30 & 1
+    c, v = psr >> 29 & 1, psr >> 28 & 1
+    return (z, not z, c, not c, n, not n, v, not v,
+            c and not z, not c or z, n == v, n != v,
+            not z and n == v, z or n != v)[cond]
+
+  def _load(self,address,size=4,signed=False):
+    if address % size: raise BusFault(address)
+    w = self.chip.read32(address) >> (8*(address & 3))
+    w &= (1 << 8*size) - 1
+    if signed and w >> (8*size - 1): w -= 1 << 8*size
+    return w & 0xffffffff
+
+  def _store(self,address,value,size=4):
+    if address % size: raise BusFault(address)
+    if size == 4: return self.chip.write32(address,value)
+    shift, mask = 8*(address & 3), (1 << 8*size) - 1
+    w = self.chip.read32(address) & ~(mask << shift)
+    self.chip.write32(address,w | ((value & mask) << shift))
+
+  def _shift(self,kind,value,amount,setcarry=True):
+    "LSL, LSR, ASR, ROR (kind 0-3) by a register amount, setting flags"
+    c = None
+    if amount:
+      if kind == 0:
+        c = value >> (32-amount) & 1 if amount <= 32 else 0
+        value = value << amount if amount < 32 else 0
+      elif kind == 1:
+        c = value >> (amount-1) & 1 if amount <= 32 else 0
+        value = value >> amount if amount < 32 else 0
+      elif kind == 2:
+        signed = value - (1 << 32) if value >> 31 else value
+        c = signed >> min(amount-1,31) & 1
+        value = signed >> min(amount,31)
+      else:
+        amount %= 32
+        value = (value >> amount) | (value << (32-amount)) if amount else value
+        c = value >> 31 & 1
+    return self._flags(value,c if setcarry else None)
+
+  def step(self):
+    r = self.core
+    pc = r[15]
+    op = self.chip.read16(pc)
+    r[15] = pc + 2
+    PC = pc + 4                      # the PC as instructions see it
+    top = op >> 11
+    if top < 3:                      # LSL, LSR, ASR by immediate
+      m, d, imm = op >> 3 & 7, op & 7, op >> 6 & 31
+      if imm == 0 and top: imm = 32
+      r[d] = self._shift(top,r[m],imm)
+    elif top == 3:                   # ADDS, SUBS register or imm3
+      n, d = op >> 3 & 7, op & 7
+      b = op >> 6 & 7 if op & 0x400 else r[op >> 6 & 7]
+      r[d] = self._sub(r[n],b) if op & 0x200 else self._add(r[n],b)
+    elif top < 8:                    # MOVS, CMP, ADDS, SUBS imm8
+      d, imm = op >> 8 & 7, op & 0xff
+      if top == 4: r[d] = self._flags(imm)
+      elif top == 5: self._sub(r[d],imm)
+      elif top == 6: r[d] = self._add(r[d],imm)
+      else: r[d] = self._sub(r[d],imm)
+    elif op >> 10 == 0x10:           # data processing
+      self._alu(op >> 6 & 0xf,op & 7,op >> 3 & 7)
+    elif op >> 10 == 0x11:           # high registers, BX, BLX
+      kind, m = op >> 8 & 3, op >> 3 & 0xf
+      d = (op & 7) | (op >> 4 & 8)
+      value = PC if m == 15 else r[m]
+      if kind == 0:
+        r[d] = (PC if d == 15 else r[d]) + value & 0xffffffff
+        if d == 15: r[15] &= ~1
+      elif kind == 1: self._sub(PC if d == 15 else r[d],value)
+      elif kind == 2:
+        r[d] = value & (~1 if d == 15 else 0xffffffff)
+      else:
+        if op & 0x80: r[14] = (pc + 2) | 1
+        if not value & 1: raise ValueError("ARM state")
+        r[15] = value & ~1
+    elif top == 9:                   # LDR literal
+      r[op >> 8 & 7] = self._load((PC & ~3) + 4*(op & 0xff))
+    elif op >> 12 == 5:              # load/store register offset
+      kind = op >> 9 & 7
+      address = r[op >> 3 & 7] + r[op >> 6 & 7] & 0xffffffff
+      t = op & 7
+      if kind == 0: self._store(address,r[t])
+      elif kind == 1: self._store(address,r[t],2)
+      elif kind == 2: self._store(address,r[t],1)
+      elif kind == 3: r[t] = self._load(address,1,True)
+      elif kind == 4: r[t] = self._load(address)
+      elif kind == 5: r[t] = self._load(address,2)
+      elif kind == 6: r[t] = self._load(address,1)
+      else: r[t] = self._load(address,2,True)
+    elif op >> 13 == 3 or op >> 12 == 8:   # load/store immediate
+      size = 2 if op >> 12 == 8 else (1 if op & 0x1000 else 4)
+      address = r[op >> 3 & 7] + size*(op >> 6 & 31)
+      if op & 0x800: r[op & 7] = self._load(address,size)
+      else: self._store(address,r[op & 7],size)
+    elif op >> 12 == 9:              # load/store SP relative
+      address = r[13] + 4*(op & 0xff)
+      if op & 0x800: r[op >> 8 & 7] = self._load(address)
+      else: self._store(address,r[op >> 8 & 7])
+    elif op >> 12 == 0xa:            # ADR, ADD rd, SP, imm8
+      base = r[13] if op & 0x800 else PC & ~3
+      r[op >> 8 & 7] = base + 4*(op & 0xff) & 0xffffffff
+    elif op >> 12 == 0xb:
+      self._misc(op,pc)
+    elif op >> 12 == 0xc:            # STM, LDM
+      n, registers = op >> 8 & 7, [ i for i in range(8) if op >> i & 1 ]
+      address = r[n]
+      for i in registers:
+        if op & 0x800: r[i] = self._load(address)
+        else: self._store(address,r[i])
+        address += 4
+      if not (op & 0x800 and n in registers): r[n] = address
+    elif op >> 12 == 0xd:            # B<cond>, SVC, UDF
+      cond = op >> 8 & 0xf
+      if cond >= 0xe: raise ValueError("SVC or UDF")
+      if self._condition(cond):
+        offset = op & 0xff
+        if offset & 0x80: offset -= 0x100
+        r[15] = PC + 2*offset & 0xffffffff
+    elif top == 0x1c:                # B
+      offset = op & 0x7ff
+      if offset & 0x400: offset -= 0x800
+      r[15] = PC + 2*offset & 0xffffffff
+    elif top == 0x1e:                # BL (32 bits)
+      op2 = self.chip.read16(pc + 2)
+      if op2 >> 14 != 3 or not op2 & 0x1000: raise ValueError("32 bit")
+      s = op >> 10 & 1
+      j1, j2 = op2 >> 13 & 1, op2 >> 11 & 1
+      i1, i2 = 1 - (j1 ^ s), 1 - (j2 ^ s)
+      offset = (i1 << 23) | (i2 << 22) | ((op & 0x3ff) << 12) | \
+               ((op2 & 0x7ff) << 1)
+      if s: offset -= 1 << 24
+      r[14] = (pc + 4) | 1
+      r[15] = pc + 4 + offset & 0xffffffff
+    else:
+      raise ValueError("undefined")
+
+  def _alu(self,kind,d,m):
+    r = self.core
+    a, b = r[d], r[m]
+    if kind == 0x0: r[d] = self._flags(a & b)
+    elif kind == 0x1: r[d] = self._flags(a ^ b)
+    elif kind in (0x2,0x3,0x4): r[d] = self._shift(kind-2,a,b & 0xff)
+    elif kind == 0x5: r[d] = self._add(a,b,r[16] >> 29 & 1)
+    elif kind == 0x6: r[d] = self._sub(a,b,r[16] >> 29 & 1)
+    elif kind == 0x7: r[d] = self._shift(3,a,b & 0xff)
+    elif kind == 0x8: self._flags(a & b)
+    elif kind == 0x9: r[d] = self._sub(0,b)
+    elif kind == 0xa: self._sub(a,b)
+    elif kind == 0xb: self._add(a,b)
+    elif kind == 0xc: r[d] = self._flags(a | b)
+    elif kind == 0xd: r[d] = self._flags(a * b)
+    elif kind == 0xe: r[d] = self._flags(a & ~b)
+    else: r[d] = self._flags(~b)
+
+  def _misc(self,op,pc):
+    r = self.core
+    if op >> 8 == 0xb0:              # ADD, SUB SP, imm7
+      imm = 4*(op & 0x7f)
+      r[13] = (r[13] - imm if op & 0x80 else r[13] + imm) & 0xffffffff
+    elif op >> 8 == 0xb2:            # SXTH, SXTB, UXTH, UXTB
+      kind, value = op >> 6 & 3, r[op >> 3 & 7]
+      size = 16 if kind in (0,2) else 8
+      value &= (1 << size) - 1
+      if kind < 2 and value >> (size-1): value -= 1 << size
+      r[op & 7] = value & 0xffffffff
+    elif op >> 9 == 0x5a:            # PUSH
+      registers = [ i for i in range(8) if op >> i & 1 ]
+      if op & 0x100: registers.append(14)
+      r[13] -= 4*len(registers)
+      for k,i in enumerate(registers): self._store(r[13] + 4*k,r[i])
+    elif op >> 9 == 0x5e:            # POP
+      registers = [ i for i in range(8) if op >> i & 1 ]
+      if op & 0x100: registers.append(15)
+      for k,i in enumerate(registers): r[i] = self._load(r[13] + 4*k)
+      r[13] += 4*len(registers)
+      if op & 0x100: r[15] &= ~1
+    elif op >> 8 == 0xba and op >> 6 & 3 != 2:   # REV, REV16, REVSH
+      kind, value = op >> 6 & 3, r[op >> 3 & 7]
+      b = [ value >> (8*i) & 0xff for i in range(4) ]
+      if kind == 0: value = b[3] | b[2] << 8 | b[1] << 16 | b[0] << 24
+      elif kind == 1: value = b[1] | b[0] << 8 | b[3] << 16 | b[2] << 24
+      else:
+        value = b[1] | b[0] << 8
+        if value & 0x8000: value |= 0xffff0000
+      r[op & 7] = value
+    elif op >> 8 == 0xbe:            # BKPT
+      r[15] = pc
+      if not self.dhcsr & 1: raise ValueError("BKPT without debugger")
+      self.halted, self.running = True, False
+      self.dhcsr |= 2
+    elif op >> 8 == 0xbf or op & 0xffef == 0xb662:  # hints, CPSIE/CPSID
+      pass
+    else:
+      raise ValueError("undefined")
+
+class SWDTarget(object):
+  '''
+  SW-DP and AHB-AP of the target, fed one SWD clock cycle at a time.
+  The host side calls hostBit() for cycles where it drives SWDIO,
+  targetBit() for cycles where it samples SWDIO and idle() for cycles
+  where nobody drives the line (turnaround).
+  '''
+  IDLE, REQUEST, ACK, WDATA = range(4)
+
+  def __init__(self,chip=None):
+    self.chip = chip or NRF51()
+    self.phase, self.bits = self.IDLE, list()
+    self.ones = 0          # consecutive high bits, for line reset
+    self.shift = 0         # last 16 host bits, for JTAG-to-SWD
+    self.lineReset = self.armed = False
+    self.swd = False
+    self.ctrlstat = 0
+    self.select = 0
+    self.rdbuf = 0
+    self.lastread = 0
+    self.csw = 0x03000040
+    self.tar = 0
+    self.ap_busy_until = 0.0
+    self.stats = { 'transactions': 0, 'wait': 0, 'fault': 0,
+                   'protocol': 0 }
+
+  # -- bit level --------------------------------------------------------
+
+  def hostBit(self,b):
+    self._lineWatch(b)
+    if self.phase == self.WDATA:
+      self.bits.append(b)
+      if len(self.bits) == 33: self._writeData()
+      return
+    if self.phase == self.REQUEST:
+      self.bits.append(b)
+      if len(self.bits) == 8: self._request()
+      return
+    if self.phase == self.ACK:
+      # host drove the line when the target should have: abandon
+      self.stats['protocol'] += 1
+      self.phase = self.IDLE
+    if b and self.swd and not self.lineReset:
+      self.phase, self.bits = self.REQUEST, [b]
+
+  def targetBit(self):
+    if self.phase == self.ACK:
+      b = self.outbits.pop(0)
+      if not self.outbits: self.phase = self.nextphase
+      return b
+    return 1               # line pulled up
+
+  def idle(self,n=1):
+    pass
+
+  def _lineWatch(self,b):
+    self.shift = ((self.shift << 1) | b) & 0xffff
+    if b:
+      self.ones += 1
+      if self.ones >= 50:
+        self.lineReset = self.armed = True
+        self.phase = self.IDLE
+    else:
+      self.ones = 0
+      self.lineReset = False
+    # the JTAG-to-SWD sequence 0xe79e is sent LSB first, so it
+    # arrives reversed in the shift register
+    if self.armed and self.shift == 0x79e7: self.swd = True
+
+  # -- SWD transactions -------------------------------------------------
+
+  def _request(self):
+    start,apndp,rnw,a2,a3,par,stop,park = self.bits
+    if not (start == 1 and stop == 0 and park == 1) or \
+       (apndp ^ rnw ^ a2 ^ a3) != par:
+      self.stats['protocol'] += 1
+      self.phase = self.IDLE
+      return
+    self.stats['transactions'] += 1
+    addr = (a2 << 2) | (a3 << 3)
+    self.apndp, self.rnw, self.addr = apndp, rnw, addr
+    ack = self._ack()
+    self.ack = ack
+    self.outbits = [ack & 1, (ack >> 1) & 1, (ack >> 2) & 1]
+    self.phase, self.bits = self.ACK, list()
+    if ack == ACK_WAIT: self.stats['wait'] += 1
+    if ack == ACK_FAULT: self.stats['fault'] += 1
+    if ack != ACK_OK and not self.ctrlstat & ORUNDETECT:
+      self.nextphase = self.IDLE     # no data phase after WAIT/FAULT
+    elif not rnw:
+      self.nextphase = self.WDATA
+    else:
+      # the read data follows the ack without a turnaround
+      data = self._read() if ack == ACK_OK else 0
+      self.outbits += [ (data >> i) & 1 for i in range(32) ]
+      self.outbits.append(parity32(data))
+      self.nextphase = self.IDLE
+
+  def _ack(self):
+    sticky = self.ctrlstat & (STICKYORUN|STICKYERR|STICKYCMP|WDATAERR)
+    if not self.apndp:
+      # IDCODE, CTRL/STAT, RESEND reads and ABORT writes always work
+      if self.rnw and self.addr in (0x0,0x4,0x8): return ACK_OK
+      if not self.rnw and self.addr == 0x0: return ACK_OK
+      if sticky: return ACK_FAULT
+      if self.addr == 0xc and self.rnw and self._apBusy():
+        return self._overrun()
+      return ACK_OK
+    if sticky: return ACK_FAULT
+    if self.ctrlstat & PWRUPACK != PWRUPACK:
+      self.ctrlstat |= STICKYERR
+      return ACK_FAULT
+    if self._apBusy(): return self._overrun()
+    return ACK_OK
+
+  def _overrun(self):
+    if self.ctrlstat & ORUNDETECT: self.ctrlstat |= STICKYORUN
+    return ACK_WAIT
+
+  def _apBusy(self):
+    return self.chip.clock() < self.ap_busy_until
+
+  def _read(self):
+    if not self.apndp:
+      if self.addr == 0x0: return IDCODE_SWDP
+      if self.addr == 0x4: return self.ctrlstat
+      if self.addr == 0x8: return self.lastread
+      self.lastread = self.rdbuf
+      return self.rdbuf
+    self.lastread = self.rdbuf
+    self.rdbuf = self._apRead(self.addr | (self.select & 0xf0))
+    return self.lastread
+
+  def _writeData(self):
+    bits = self.bits
+    self.phase, self.bits = self.IDLE, list()
+    value = sum(bits[i] << i for i in range(32))
+    if parity32(value) != bits[32]:
+      self.ctrlstat |= WDATAERR
+      return
+    if self.ack != ACK_OK: return      # overrun: data phase discarded
+    if not self.apndp:
+      if self.addr == 0x0: self._abort(value)
+      elif self.addr == 0x4: self._setCtrlstat(value)
+      elif self.addr == 0x8: self.select = value
+      return
+    self._apWrite(self.addr | (self.select & 0xf0),value)
+
+  def _abort(self,value):
+    if value & 0x02: self.ctrlstat &= ~STICKYCMP
+    if value & 0x04: self.ctrlstat &= ~STICKYERR
+    if value & 0x08: self.ctrlstat &= ~WDATAERR
+    if value & 0x10: self.ctrlstat &= ~STICKYORUN
+    if value & 0x01: self.ap_busy_until = 0.0
+
+  def _setCtrlstat(self,value):
+    keep = self.ctrlstat & (STICKYORUN|STICKYCMP|STICKYERR|WDATAERR)
+    value &= 0xf0000f01 & ~PWRUPACK
+    # writing 1 to a sticky bit clears it (JTAG-DP only); on SW-DP
+    # the sticky flags are cleared through ABORT
+    ack = (value & PWRUPREQ) << 1
+    self.ctrlstat = value | ack | keep
+
+  # -- AHB-AP -----------------------------------------------------------
+
+  def _increment(self):
+    if (self.csw >> 4) & 3 == 1:
+      size = 1 << (self.csw & 7)
+      self.tar = (self.tar & ~0x3ff) | ((self.tar + size) & 0x3ff)
+
+  def _memory(self,address,value=None):
+    self.chip.cpu.run()
+    delay = self.chip.accessDelay(address)
+    try:
+      if value is None: r = self.chip.read32(address)
+      else:             r = self.chip.write32(address,value)
+    except BusFault:
+      self.ctrlstat |= STICKYERR
+      r = 0
+    delay = max(delay,self.chip.accessDelay(address))
+    self.ap_busy_until = self.chip.clock() + delay
+    return r
+
+  def _apRead(self,reg):
+    if reg == 0x00:
+      r = self.csw | 0x40
+      if self._apBusy(): r |= 0x80
+      return r
+    if reg == 0x04: return self.tar
+    if reg == 0x0c:
+      r = self._memory(self.tar)
+      self._increment()
+      return r
+    if 0x10 <= reg <= 0x1c:
+      return self._memory((self.tar & ~0xf) | (reg & 0xc))
+    if reg == 0xf4: return 0
+    if reg == 0xf8: return 0xf0000003
+    if reg == 0xfc: return AHB_AP_IDR
+    return 0
+
+  def _apWrite(self,reg,value):
+    if reg == 0x00: self.csw = (self.csw & ~0xf37) | (value & 0xf37)
+    elif reg == 0x04: self.tar = value
+    elif reg == 0x0c:
+      self._memory(self.tar,value)
+      self._increment()
+    elif 0x10 <= reg <= 0x1c:
+      self._memory((self.tar & ~0xf) | (reg & 0xc),value)
+
+class BusPirate(object):
+  '''
+  Byte level model of the Bus Pirate binary interface.  feed() takes the
+  bytes the host wrote and returns the bytes the Bus Pirate answers with.
+  '''
+  TERMINAL, BBIO, RAWWIRE = range(3)
+
+  def __init__(self,target=None):
+    self.target = target or SWDTarget()
+    self.mode = self.TERMINAL
+    self.config = 0
+    self.speed = 0
+    self.periph = 0
+    self.pending = None    # (command, bytes still expected)
+    self.stats = { 'commands': 0 }
+
+  def feed(self,data):
+    out = bytearray()
+    for c in bytearray(data):
+      out.extend(self._byte(c))
+    return bytes(out)
+
+  def _byte(self,c):
+    if self.mode == self.TERMINAL:
+      if c == 0x00:
+        self.mode = self.BBIO
+        return b"BBIO1"
+      return b""
+    if self.mode == self.BBIO:
+      if c == 0x00: return b"BBIO1"
+      if c == 0x05:
+        self.mode = self.RAWWIRE
+        return b"RAW1"
+      if c == 0x0f:
+        self.mode = self.TERMINAL
+        return b"\x01" + b"Bus Pirate v3.b\r\nFirmware v5.10\r\n"
+      return b"\x00"
+    return self._raw(c)
+
+  def _lsb(self):
+    return bool(self.config & 0x02)
+
+  def _raw(self,c):
+    t = self.target
+    if self.pending:
+      command, count = self.pending
+      if command == 0x10:
+        bits = range(8) if self._lsb() else range(7,-1,-1)
+        for i in bits: t.hostBit((c >> i) & 1)
+      else:
+        for i in range(7,7-count,-1): t.hostBit((c >> i) & 1)
+        count = 1
+      count -= 1 if command == 0x10 else 0
+      if command == 0x10 and count > 0: self.pending = (command,count)
+      else: self.pending = None
+      return b"\x01"
+    self.stats['commands'] += 1
+    if c == 0x00:
+      self.mode = self.BBIO
+      return b"BBIO1"
+    if c == 0x01: return b"RAW1"
+    if c == 0x06:
+      bits = [ t.targetBit() for i in range(8) ]
+      if not self._lsb(): bits.reverse()
+      return bytes(bytearray([sum(b << i for i,b in enumerate(bits))]))
+    if c == 0x07: return b"\x01" if t.targetBit() else b"\x00"
+    if c == 0x09:
+      t.idle(1)
+      return b"\x01"
+    if c in (0x02,0x03,0x04,0x05,0x0a,0x0b,0x0c,0x0d): return b"\x01"
+    if c == 0x08: return b"\x01"
+    hi = c & 0xf0
+    if hi == 0x10:
+      self.pending = (0x10,(c & 0x0f)+1)
+      return b"\x01"
+    if hi == 0x20:
+      t.idle((c & 0x0f)+1)
+      return b"\x01"
+    if hi == 0x30:
+      self.pending = (0x30,(c & 0x07)+1)
+      return b"\x01"
+    if hi == 0x40: self.periph = c & 0x0f; return b"\x01"
+    if hi == 0x60: self.speed = c & 0x03; return b"\x01"
+    if hi == 0x80: self.config = c & 0x0f; return b"\x01"
+    return b"\x00"
+
+class SimPort(object):
+  '''
+  Stand-in for serial.Serial: whatever is written is fed to the Bus
+  Pirate model at once and its answers are buffered for read().  The
+  time the bytes would spend on a serial line at the given baud rate,
+  and the USB latency paid each time the host turns around to wait
+  for an answer, are charged to the model's clock.
+  '''
+  def __init__(self,pirate=None,baud=115200,latency=0.001):
+    self.pirate = pirate or BusPirate()
+    self.clock = self.pirate.target.chip.clock
+    self.baud, self.latency = baud, latency
+    self.inbuf = bytearray()
+    self.turnaround = False
+    self.stats = { 'writes': 0, 'bytes_out': 0, 'reads': 0, 'bytes_in': 0,
+                   'link_time': 0.0 }
+
+  def _charge(self,seconds):
+    self.stats['link_time'] += seconds
+    if hasattr(self.clock,'advance'): self.clock.advance(seconds)
+
+  def write(self,data):
+    self.stats['writes'] += 1
+    self.stats['bytes_out'] += len(data)
+    self.turnaround = True
+    perbyte = 10.0/self.baud
+    for c in bytearray(data):
+      # each byte reaches the Bus Pirate one character time later
+      self._charge(perbyte)
+      self.inbuf.extend(self.pirate.feed(bytearray([c])))
+    return len(data)
+
+  def read(self,n=1):
+    if self.turnaround:
+      self._charge(self.latency)
+      self.turnaround = False
+    r = bytes(self.inbuf[:n])
+    del self.inbuf[:n]
+    self.stats['reads'] += 1
+    self.stats['bytes_in'] += len(r)
+    return r
+
+  def inWaiting(self):
+    return len(self.inbuf)
+
+  @property
+  def timescale(self):
+    "how much longer than on a real target code takes to run on the model"
+    return self.pirate.target.chip.cpu.slowdown()
+
+  @property
+  def in_waiting(self):
+    return len(self.inbuf)
+
+  def flush(self): pass
+
+  def flushInput(self):
+    del self.inbuf[:]
+
+  reset_input_buffer = flushInput
+
+  def close(self): pass
+
+class SimBBIO(BBIO):
+  '''
+  BBIO talking to the model in-process. With an image file the flash 
+  starts with its contents, and is written back to it by save().
+  '''
+  def __init__(self,p=None,s=115200,t=1,chip=None,image=None):
+    self.chip = chip or NRF51()
+    self.image = image
+    if image and os.path.exists(image): self.chip.load(image)
+    self.port = SimPort(BusPirate(SWDTarget(self.chip)),baud=s)
+
+  def save(self):
+    if not self.image: return
+    with open(self.image,'wb') as F:
+      F.write(bytes(self.chip.flash))
+
+  def BBmode(self):
+    self.port.flushInput()
+    for i in range(20):
+      self.port.write("\x00")
+      if self.port.inWaiting(): break
+    if self.response(5) == "BBIO1": return 1
+    else: return 0
+
+  def timeout(self, timeout=0.1):
+    pass
+
+def serve(pirate,verbose=False):
+  "run the model behind a pty until interrupted"
+  import pty, tty
+  master, slave = pty.openpty()
+  tty.setraw(slave)
+  sys.stdout.write("Bus Pirate model on {0}\n".format(os.ttyname(slave)))
+  sys.stdout.flush()
+  try:
+    while True:
+      data = os.read(master,4096)
+      answer = pirate.feed(data)
+      if verbose:
+        sys.stdout.write("> {0}\n< {1}\n".format(
+          " ".join("{0:02x}".format(c) for c in bytearray(data)),
+          " ".join("{0:02x}".format(c) for c in bytearray(answer))))
+        sys.stdout.flush()
+      if answer: os.write(master,answer)
+  except KeyboardInterrupt:
+    pass
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(description='Bus Pirate and nRF51 model on a pty')
+  parser.add_argument('--image',metavar='image',default=None,
+            help='file with the initial flash contents')
+  parser.add_argument('--verbose',action="store_true",
+            help='show the traffic')
+  args = parser.parse_args()
+  chip = NRF51(clock=time.time)
+  if args.image: chip.load(args.image)
+  serve(BusPirate(SWDTarget(chip)),verbose=args.verbose)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+import os, sys, time, struct, marshal
+
+# BY TED HERMAN
+
+'''
+  The register database of an nRF5 SVD file (SVD/nrf51.svd and
+  SVD/nrf52.svd in this repo): peripherals, registers, fields and
+  reset values, by name (as "NVMC.READY", "RADIO.DAB[3]" or
+  "PPI.CH[2].EEP") and by address.
+
+  Parsing the XML costs a hundred times as much as reading the result
+  back, so it is done once and compiled into a cache file (in the svd
+  directory of the cachedir, ~/.nrftool by default) made of marshal
+  data: an index of the peripherals and registers, and one blob per
+  peripheral with the fields and their enumerated values, only decoded
+  when a register of that peripheral is decoded. The cache is rebuilt
+  when the SVD file changes.
+
+     python nrfsvd.py ../SVD/nrf51.svd                  (summary)
+     python nrfsvd.py ../SVD/nrf51.svd NVMC.CONFIG 0x4001e400
+'''
+
+CACHE_MAGIC = "NRFSVD1\n"
+
+class SvdError(Exception): pass
+
+def number(text):
+  "an SVD scaled integer: decimal, 0x hex or #binary"
+  text = text.strip().lower()
+  if text.startswith("#"): return int(text[1:],2)
+  return int(text,0)
+
+def dimNames(name,element):
+  "the names of the elements of a dim array, or just name"
+  dim = element.findtext("dim")
+  if dim is None: return [(name,0)]
+  dim, increment = number(dim), number(element.findtext("dimIncrement") or "0")
+  index = element.findtext("dimIndex")
+  if index and "-" in index and "," not in index:
+    first, last = index.split("-")
+    index = [ str(i) for i in range(int(first),int(last)+1) ]
+  elif index:
+    index = index.split(",")
+  else:
+    index = [ str(i) for i in range(dim) ]
+  return [ (name.replace("%s",index[i]),i*increment) for i in range(dim) ]
+
+def fieldBits(field):
+  "bit offset and width of a field, however the SVD gives them"
+  if field.findtext("bitOffset") is not None:
+    return number(field.findtext("bitOffset")), number(field.findtext("bitWidth") or "1")
+  if field.findtext("lsb") is not None:
+    lsb, msb = number(field.findtext("lsb")), number(field.findtext("msb"))
+    return lsb, msb - lsb + 1
+  msb, lsb = field.findtext("bitRange").strip("[]").split(":")
+  return int(lsb), int(msb) - int(lsb) + 1
+
+def compileSvd(filename):
+  '''
+  Parse an SVD file into (index,blobs): index is a dict with the
+  device name, 'peripherals' (name to base address), 'registers'
+  (name to (address,size,reset,access)) and 'addresses' (address to
+  the names of the registers there, as peripherals can share an
+  address); blobs has the marshalled fields of each peripheral, a
+  dict of register name to [(field,offset,width,{value: name})]
+  '''
+  from xml.etree import cElementTree as ElementTree
+  try:
+    device = ElementTree.parse(filename).getroot()
+  except (SyntaxError,ElementTree.ParseError) as e:
+    raise SvdError("{0}: {1}".format(filename,e))
+  defaults = (number(device.findtext("size") or "32"),
+              number(device.findtext("resetValue") or "0"),
+              device.findtext("access") or "read-write")
+  elements = dict( (p.findtext("name"),p) for p in device.iter("peripheral") )
+  peripherals, registers, addresses, blobs = dict(), dict(), dict(), dict()
+
+  def properties(element,inherited):
+    size, reset, access = inherited
+    return (number(element.findtext("size") or str(size)),
+            number(element.findtext("resetValue") or str(reset)),
+            element.findtext("access") or access)
+
+  def walk(parent,prefix,base,inherited,fields):
+    for element in parent:
+      if element.tag not in ("register","cluster"): continue
+      offset = number(element.findtext("addressOffset"))
+      here = properties(element,inherited)
+      for name, step in dimNames(element.findtext("name"),element):
+        name, address = prefix + name, base + offset + step
+        if element.tag == "cluster":
+          walk(element,name + ".",address,here,fields)
+          continue
+        registers[name] = (address,) + here
+        addresses.setdefault(address,list()).append(name)
+        fields[name] = list()
+        for field in element.iter("field"):
+          offset_, width = fieldBits(field)
+          values = dict()
+          for value in field.iter("enumeratedValue"):
+            try:
+              values[number(value.findtext("value"))] = value.findtext("name")
+            except (TypeError,ValueError):   # isDefault, or "don't care" bits
+              pass
+          fields[name].append((field.findtext("name"),offset_,width,values))
+
+  for name, element in elements.items():
+    base = number(element.findtext("baseAddress"))
+    source = element
+    if element.get("derivedFrom") and element.find("registers") is None:
+      if element.get("derivedFrom") not in elements:
+        raise SvdError("{0}: peripheral {1} is derived from {2}, which is not there".format(
+                       filename,name,element.get("derivedFrom")))
+      source = elements[element.get("derivedFrom")]
+    fields = dict()
+    walk(source.find("registers") if source.find("registers") is not None else [],
+         name + ".",base,properties(element,defaults),fields)
+    peripherals[name] = base
+    blobs[name] = marshal.dumps(fields)
+  index = { 'device': device.findtext("name"), 'peripherals': peripherals,
+            'registers': registers, 'addresses': addresses }
+  return index, blobs
+
+class Device(object):
+  '''
+  The compiled database: register(name), at(address), fields(name)
+  and decode(name,value); the fields of a peripheral are unmarshalled
+  on first use
+  '''
+  def __init__(self,index,data,offsets):
+    self.name = index['device']
+    self.peripherals = index['peripherals']
+    self.registers = index['registers']
+    self.addresses = index['addresses']
+    self.data, self.offsets = data, offsets
+    self.decoded = dict()
+
+  def register(self,name):
+    "(address,size,reset,access) of register name, e.g. NVMC.READY"
+    return self.registers[name]
+
+  def at(self,address):
+    "the names of the registers at address"
+    return self.addresses.get(address,[])
+
+  def fields(self,name):
+    "[(field,offset,width,{value: name})] of register name"
+    peripheral = name.split(".")[0]
+    if peripheral not in self.decoded:
+      start, length = self.offsets[peripheral]
+      self.decoded[peripheral] = marshal.loads(self.data[start:start+length])
+    return self.decoded[peripheral][name]
+
+  def decode(self,name,value):
+    "the fields of a value of register name, as (field,value,enumerated name or None)"
+    return [ (field,(value >> offset) & ((1 << width) - 1),
+              values.get((value >> offset) & ((1 << width) - 1)))
+             for field, offset, width, values in self.fields(name) ]
+
+def cachePath(filename,cachedir):
+  return os.path.join(os.path.expanduser(cachedir),"svd",
+                      os.path.basename(filename) + ".cache")
+
+def stamp(filename):
+  "what the cache is checked against: the size and time of the SVD file"
+  info = os.stat(filename)
+  return [info.st_size,int(info.st_mtime)]
+
+def pack(blobs):
+  "the blobs one after another, and the (start,length) of each"
+  offsets, position = dict(), 0
+  for name in sorted(blobs):
+    offsets[name] = (position,len(blobs[name]))
+    position += len(blobs[name])
+  return "".join(blobs[name] for name in sorted(blobs)), offsets
+
+def save(path,source,index,data,offsets):
+  "the cache: magic, the length of the index, the index, then the blobs"
+  head = marshal.dumps((source,index,offsets))
+  if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+  with open(path+".tmp",'wb') as F:
+    F.write(CACHE_MAGIC + struct.pack("<I",len(head)) + head + data)
+  os.rename(path+".tmp",path)
+
+def load(filename,cachedir="~/.nrftool"):
+  '''
+  The Device of an SVD file, from its cache if that is up to date, or
+  compiled (and cached) otherwise
+  '''
+  path = cachePath(filename,cachedir)
+  source = stamp(filename)
+  try:
+    with open(path,'rb') as F:
+      content = F.read()
+    assert content.startswith(CACHE_MAGIC)
+    n, = struct.unpack_from("<I",content,len(CACHE_MAGIC))
+    start = len(CACHE_MAGIC) + 4
+    cached, index, offsets = marshal.loads(content[start:start+n])
+    assert cached == source
+    return Device(index,buffer(content,start+n),offsets)
+  except (IOError,AssertionError,ValueError,EOFError,TypeError,struct.error):
+    pass
+  index, blobs = compileSvd(filename)
+  data, offsets = pack(blobs)
+  try:
+    save(path,source,index,data,offsets)
+  except (IOError,OSError):
+    sys.stderr.write("Unable to write the SVD cache '{0}'\n".format(path))
+  return Device(index,data,offsets)
+
+def main():
+  import argparse
+  parser = argparse.ArgumentParser(description='nRF5 SVD register database')
+  parser.add_argument('svd',help='SVD file, eg SVD/nrf51.svd')
+  parser.add_argument('registers',nargs='*',
+            help='register names (PERIPHERAL.REGISTER) or addresses to show')
+  parser.add_argument('--cachedir',metavar='cachedir',default="~/.nrftool",
+            help='directory of the compiled SVD cache')
+  args = parser.parse_args()
+  start = time.time()
+  try:
+    device = load(args.svd,args.cachedir)
+  except (IOError,SvdError) as e:
+    sys.stderr.write("Error reading SVD: {0}\n".format(e))
+    sys.exit(1)
+  sys.stdout.write("{0}: {1} peripherals, {2} registers, loaded in {3:.1f} ms\n".format(
+                   device.name,len(device.peripherals),len(device.registers),
+                   1000*(time.time() - start)))
+  for item in args.registers:
+    try:
+      names = device.at(int(item,0))
+    except ValueError:
+      names = [item] if item in device.registers else []
+    if not names:
+      sys.stderr.write("No register {0}\n".format(item))
+      sys.exit(1)
+    for name in names:
+      address, size, reset, access = device.register(name)
+      sys.stdout.write("{0:08x} {1} ({2} bits, {3}, reset {4:08x})\n".format(
+                       address,name,size,access,reset))
+      for field, offset, width, values in device.fields(name):
+        sys.stdout.write("   [{0}:{1}] {2}{3}\n".format(offset+width-1,offset,field,
+                         "  " + " ".join("{0}={1}".format(v,values[v]) for v in sorted(values))
+                         if values else ""))
+
+if __name__ == "__main__": main()
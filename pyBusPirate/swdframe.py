@@ -0,0 +1,212 @@
+import struct, collections
+
+# BY TED HERMAN
+
+'''
+  Precompiled SWD frames for the Bus Pirate raw-wire mode, as used by
+  nrftool, nrf15.py and nrfErase.py (3.3v, 2-wire, LSB first).
+
+  An SWD request is eight bits, in wire order:
+
+     start(1) APnDP RnW A2 A3 parity stop(0) park(1)
+
+  so there are only 16 distinct requests: DP or AP, read or write, and
+  one of four register addresses.  They are computed once, already
+  bit-reversed for LSB-first transmission and with their parity bit.
+
+  Every transaction is encoded the way nrftool has always sent it:
+
+     write:  [turn] 10 <request> 07 07 07  21  13 <4 data bytes> 30 <parity>
+     read:   [turn] 10 <request> 07 07 07  06 06 06 06 07
+
+  where 10/13 are bulk writes of 1/4 bytes, 07 reads one bit (the three
+  ack bits, or the parity of read data), 06 reads a byte, 30 writes one
+  bit (the top bit of the byte that follows, 80 or 00) and the turn 21
+  is two clock ticks.  A read that follows a read, or a write that
+  follows a read, starts with a turn.
+
+  Each command byte is answered by exactly one byte, so the expected
+  answers line up with the stream: 1 is an 0x01 acknowledgement from
+  the Bus Pirate, 2 an SWD ack bit, 3 a data byte and 4 a parity bit
+  (the codes of read_queue in nrftool).
+
+  writeStream() and readStream() produce the whole stream for a run of
+  transactions on one register, e.g. a page of DRW writes, as a single
+  bytearray built with slice assignment rather than per-word strings.
+
+  Expect keeps the expected answers run-length encoded, as repetitions
+  of a frame pattern (a page of writes is one entry), and decode()
+  checks and splits the answers to a whole batch by taking strided
+  slices of each run: one comparison per position in the pattern and
+  one struct.unpack per run of words, however long the run is.
+'''
+
+CMD_READ_BYTE   = 0x06
+CMD_READ_BIT    = 0x07
+CMD_WRITE_BYTES = 0x10
+CMD_CLOCK_TICKS = 0x20
+CMD_WRITE_BITS  = 0x30
+TURN = CMD_CLOCK_TICKS | 0x01
+
+REVBITS = bytearray(int("{0:08b}".format(i)[::-1],2) for i in range(256))
+PARITY8 = bytearray(bin(i).count("1") & 1 for i in range(256))
+PARITYBYTE = bytearray([0x00,0x80])   # parity bit, as sent by CMD_WRITE_BITS
+
+def _request(Register,DP,Read):
+  command = 0x81   # start and park
+  if not DP: command |= 0x40
+  if Read:   command |= 0x20
+  command |= {0:0x00, 4:0x10, 8:0x08, 0xc:0x18}[Register]
+  if PARITY8[command & 0x78]: command |= 0x04
+  return REVBITS[command]
+
+REQUEST = dict( ((Register,DP,Read),_request(Register,DP,Read))
+                for Register in (0,4,8,0xc)
+                for DP in (True,False) for Read in (True,False) )
+REQUEST_CHR = dict( (k,chr(v)) for k,v in REQUEST.items() )
+
+def request(Register=0,DP=True,Read=True):
+  "the request as a one character string"
+  return REQUEST_CHR[(Register,DP,Read)]
+
+def parity(word):
+  return PARITY8[(word ^ (word >> 8) ^ (word >> 16) ^ (word >> 24)) & 0xff]
+
+def word(Value):
+  "the four data bytes of a write, LSB first"
+  return struct.pack("<I",Value)
+
+ACKOK = bytearray([1,0,0])
+ONE = bytearray([1])
+
+WRITE_FRAME = (1,1, 2,2,2, 1, 1,1,1,1,1, 1,1)
+READ_FRAME = (1,1, 2,2,2, 3,3,3,3,4)
+TURN_READ_FRAME = (1,) + READ_FRAME
+
+def writeStream(Register,DP,values,afterRead=False):
+  '''
+  Commands for a run of writes of values to one register, and the 
+  expected answers as (pattern,count) runs. afterRead says whether the
+  previous transaction on the link was a read (and so needs a turn).
+  '''
+  n = len(values)
+  frame = bytearray([CMD_WRITE_BYTES, REQUEST[(Register,DP,False)],
+                     CMD_READ_BIT, CMD_READ_BIT, CMD_READ_BIT, TURN,
+                     CMD_WRITE_BYTES|3, 0, 0, 0, 0, CMD_WRITE_BITS, 0])
+  stream = frame*n
+  data = bytearray(struct.pack("<{0}I".format(n),*values))
+  b0, b1, b2, b3 = data[0::4], data[1::4], data[2::4], data[3::4]
+  stream[7::13], stream[8::13], stream[9::13], stream[10::13] = b0,b1,b2,b3
+  stream[12::13] = bytearray( PARITYBYTE[PARITY8[a^b^c^d]]
+                              for a,b,c,d in zip(b0,b1,b2,b3) )
+  runs = [(WRITE_FRAME,n)]
+  if afterRead and n:
+    stream.insert(0,TURN)
+    runs.insert(0,((1,),1))
+  return stream, runs
+
+def readStream(Register,DP,count,afterRead=False):
+  '''
+  Commands for count reads of one register, and the expected answers;
+  see writeStream() for afterRead.
+  '''
+  frame = bytearray([TURN, CMD_WRITE_BYTES, REQUEST[(Register,DP,True)],
+                     CMD_READ_BIT, CMD_READ_BIT, CMD_READ_BIT,
+                     CMD_READ_BYTE, CMD_READ_BYTE, CMD_READ_BYTE,
+                     CMD_READ_BYTE, CMD_READ_BIT])
+  stream = frame*count
+  runs = [(TURN_READ_FRAME,count)]
+  if not afterRead and count:
+    del stream[0]
+    runs = [(READ_FRAME,1),(TURN_READ_FRAME,count-1)]
+  return stream, runs
+
+class Expect(object):
+  '''
+  Answers expected for queued commands: a deque of [pattern,count] 
+  entries, where pattern is a tuple of answer codes repeated count 
+  times. append() and extend() take codes as the read_queue lists 
+  of nrftool always have; a list given to extend() is kept together 
+  as one pattern, so an ack triple or a word and its parity never 
+  straddle two entries.
+  '''
+  def __init__(self):
+    self.runs = collections.deque()
+    self.total = 0
+
+  def frames(self,pattern,count=1):
+    if not count: return
+    if self.runs and self.runs[-1][0] == pattern:
+      self.runs[-1][1] += count
+    else:
+      self.runs.append([pattern,count])
+    self.total += len(pattern)*count
+
+  def append(self,code):
+    self.frames((code,))
+
+  def extend(self,codes):
+    self.frames(tuple(codes))
+
+  def __len__(self):
+    return self.total
+
+  def __nonzero__(self):
+    return self.total > 0
+
+  __bool__ = __nonzero__
+
+  def __repr__(self):
+    return " ".join("{0}x{1}".format("".join(str(c) for c in p),n)
+                    for p,n in self.runs)
+
+_layouts = dict()
+
+def _layout(pattern):
+  "positions of acknowledgements, ack bits and words (4 bytes + parity)"
+  if pattern not in _layouts:
+    ones = [ k for k,c in enumerate(pattern) if c == 1 ]
+    acks = [ k for k,c in enumerate(pattern) if c == 2 ]
+    words = [ k for k in range(len(pattern)-4)
+              if pattern[k:k+5] == (3,3,3,3,4) ]
+    assert 5*len(words) == sum(1 for c in pattern if c in (3,4))
+    _layouts[pattern] = (ones,acks,words)
+  return _layouts[pattern]
+
+def decode(response,expect):
+  '''
+  Check the answers to a batch against an Expect, returning the words
+  read (parity checked) and the ack bits, in order, as a bytearray
+  '''
+  response = bytearray(response)
+  assert len(response) == len(expect)
+  words, acks, pos = list(), bytearray(), 0
+  for pattern, count in expect.runs:
+    L = len(pattern)
+    block = response[pos:pos+L*count]
+    pos += L*count
+    ones, ackpos, wordpos = _layout(pattern)
+    for k in ones:
+      assert block[k::L] == ONE*count
+    if ackpos:
+      if all(block[k::L] == ACKOK[i % 3:1 + i % 3]*count
+             for i,k in enumerate(ackpos)):
+        acks.extend(ACKOK*(count*len(ackpos)//3))
+      else:
+        for i in range(count):
+          acks.extend(block[i*L+k] for k in ackpos)
+    if wordpos:
+      rows = list()
+      for k in wordpos:
+        data = bytearray(4*count)
+        for j in range(4): data[j::4] = block[k+j::L]
+        row = struct.unpack("<{0}I".format(count),bytes(data))
+        assert block[k+4::L] == bytearray(parity(w) for w in row)
+        rows.append(row)
+      for i in range(count):
+        words.extend(row[i] for row in rows)
+  return words, acks
+
+def acksOK(acks):
+  "all ack triples are OK (not WAIT or FAULT)"
+  return acks == ACKOK*(len(acks)//3)